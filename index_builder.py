@@ -4,12 +4,35 @@ Author: TP Indexation
 Description: Builds and saves inverted indexes from a JSONL file
 """
 
+import contextlib
+import heapq
 import json
+import mmap
+import multiprocessing
+import os
+import pickle
 import re
+import sys
+import tempfile
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Set, Tuple, Any
-from urllib.parse import urlparse, parse_qs
+from typing import ContextManager, Dict, Iterable, Iterator, List, Set, Tuple, Any
+from urllib.parse import unquote_plus
+
+
+# Precompiled patterns
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9\s]')
+_PRODUCT_ID_RE = re.compile(r'/product/(\d+)')
+_VARIANT_RE = re.compile(r'(?:^|&)variant=([^&]+)')
+
+# ASCII translation table: lowercases letters and maps punctuation to spaces
+_ASCII_TOKEN_TABLE = str.maketrans({
+    c: (c.lower() if c.isalnum() or c.isspace() else ' ')
+    for c in map(chr, range(128))
+})
+
+# Compact JSON encoder used when saving indexes
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
 
 
 class IndexBuilder:
@@ -18,31 +41,68 @@ class IndexBuilder:
     """
     
     # Stopwords
-    STOPWORDS = {
+    STOPWORDS = frozenset({
         'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
         'of', 'with', 'by', 'from', 'is', 'are', 'am', 'be', 'been', 'being',
         'that', 'this', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they',
-    }
+    })
+    
+    # Number of JSONL lines parsed together
+    PARSE_BATCH_SIZE = 1000
+    
+    # Maximum number of run files merged at once when spilling
+    MERGE_FAN_IN = 64
     
-    def __init__(self, input_file: str, output_dir: str = "indexes"):
+    # Supported on-disk formats and their file extensions
+    INDEX_FORMATS = {'json': '.json', 'pickle': '.pkl'}
+    
+    def __init__(self, input_file: str, output_dir: str = "indexes", index_format: str = "json",
+                 spill_threshold: int | None = None, doc_ids: bool = False):
         """
         Initialize the index builder.
         
         Args:
             input_file: Path to input JSONL file
-            output_dir: Output directory for index JSON files
+            output_dir: Output directory for index files
+            index_format: Output format, 'json' or 'pickle' (binary, faster to save and load)
+            spill_threshold: Number of buffered (token, url) postings after which the
+                positional indexes are written to temporary run files (None keeps
+                everything in memory). Requires the JSON format, which is saved
+                without loading the merged runs back into memory
+            doc_ids: Key postings by dense integer document IDs instead of URLs,
+                and save the ID -> URL table as the 'docs' index
         """
+        if index_format not in self.INDEX_FORMATS:
+            raise ValueError(f"Unknown index format '{index_format}'")
+        if spill_threshold is not None and index_format != 'json':
+            raise ValueError("spill_threshold requires the 'json' index format")
+        
         self.input_file = input_file
+        self.index_format = index_format
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         
         # Initialize different indexes
-        self.title_index = defaultdict(lambda: defaultdict(list))
-        self.description_index = defaultdict(lambda: defaultdict(list))
-        self.brand_index = defaultdict(set)
-        self.origin_index = defaultdict(set)
+        self.title_index: Dict[str, Dict[str, List[int]]] = {}
+        self.description_index: Dict[str, Dict[str, List[int]]] = {}
+        # Simple indexes map tokens to {url: None}, an insertion-ordered set
+        self.brand_index = defaultdict(dict)
+        self.origin_index = defaultdict(dict)
         self.reviews_index = {}
         
+        # Document IDs, assigned in input order (only used when doc_ids is set)
+        self.doc_ids = doc_ids
+        self._doc_ids: Dict[str, int] = {}
+        
+        # Spilling of positional indexes to sorted run files
+        self.spill_threshold = spill_threshold
+        self._buffered_postings = 0
+        self._spill_dir = None
+        self._spill_path: Path | None = None
+        self._run_prefix = ''
+        self._run_count = 0
+        self._runs: Dict[str, List[Path]] = {'title': [], 'description': []}
+        
     def extract_url_info(self, url: str) -> Tuple[str, str | None]:
         """
         Extract product ID and variant from URL.
@@ -54,13 +114,13 @@ class IndexBuilder:
             Tuple (product_id, variant) where variant can be None
         """
         # Extract product_id: last number in path
-        match = re.search(r'/product/(\d+)', url)
+        match = _PRODUCT_ID_RE.search(url)
         product_id = match.group(1) if match else None
         
-        # Extract variant from query parameters
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        variant = query_params.get('variant', [None])[0]
+        # Extract variant from query parameters (query string without fragment)
+        query = url.partition('#')[0].partition('?')[2]
+        match = _VARIANT_RE.search(query)
+        variant = unquote_plus(match.group(1)) if match else None
         
         return product_id, variant
     
@@ -74,34 +134,436 @@ class IndexBuilder:
         Returns:
             List of tokens
         """
-        # Convert to lowercase
-        text = text.lower()
-        # Keep only alphanumeric characters and spaces
-        text = re.sub(r'[^a-z0-9\s]', ' ', text)
+        if text.isascii():
+            # Lowercase and remove punctuation in a single pass
+            text = text.translate(_ASCII_TOKEN_TABLE)
+        else:
+            # Convert to lowercase
+            text = text.lower()
+            # Keep only alphanumeric characters and spaces
+            text = _NON_ALNUM_RE.sub(' ', text)
         # Split by spaces
         tokens = text.split()
-        # Remove stopwords and empty strings
-        tokens = [t for t in tokens if t and t not in self.STOPWORDS]
+        # Remove stopwords and intern the rest (tokens repeat across documents)
+        stopwords = self.STOPWORDS
+        intern = sys.intern
+        tokens = [intern(t) for t in tokens if t not in stopwords]
         
         return tokens
     
-    def process_jsonl(self):
+    def _tokenize_short(self, text: str) -> List[str]:
+        """
+        Tokenize a short feature value such as a brand or an origin.
+        
+        Single ASCII words (the usual case) skip the translation pass;
+        anything else goes through tokenize().
+        
+        Args:
+            text: Text to tokenize
+            
+        Returns:
+            List of tokens
+        """
+        if text.isascii() and text.isalnum():
+            token = text.lower()
+            return [] if token in self.STOPWORDS else [sys.intern(token)]
+        return self.tokenize(text)
+    
+    def process_jsonl(self, workers: int = 1):
         """
         Read and process the JSONL file.
+        
+        Args:
+            workers: Number of worker processes (1 processes the file in this process)
+        """
+        if workers > 1:
+            self._process_jsonl_parallel(workers)
+            return
+        
+        try:
+            with open(self.input_file, 'rb') as f, self._map_file(f) as mm:
+                lines = self._iter_lines(mm, 0, len(mm))
+                numbered_lines = ((line_num, line) for line_num, (_, line) in enumerate(lines, 1))
+                self._process_lines(numbered_lines, 'line')
+        except FileNotFoundError:
+            print(f"Error: File '{self.input_file}' not found")
+            raise
+    
+    def _process_jsonl_parallel(self, workers: int):
+        """
+        Process the JSONL file in byte-range chunks across worker processes
+        and merge the partial indexes.
+        
+        Args:
+            workers: Number of worker processes
         """
         try:
-            with open(self.input_file, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f, 1):
-                    try:
-                        product = json.loads(line.strip())
-                        self._process_product(product)
-                    except json.JSONDecodeError as e:
-                        print(f"JSON Error at line {line_num}: {e}")
-                    except Exception as e:
-                        print(f"Error processing line {line_num}: {e}")
+            chunks = self._chunk_ranges(workers * 4)
         except FileNotFoundError:
             print(f"Error: File '{self.input_file}' not found")
             raise
+        
+        # With spilling, workers write their runs to this builder's run directory
+        spill_dir = str(self._spill_directory()) if self.spill_threshold is not None else None
+        tasks = [
+            (self.input_file, str(self.output_dir), self.doc_ids,
+             self.spill_threshold, spill_dir, chunk, start, end)
+            for chunk, (start, end) in enumerate(chunks)
+        ]
+        with multiprocessing.Pool(workers) as pool:
+            # imap keeps chunk order, so the merged indexes match a sequential run
+            for partial in pool.imap(_build_partial_indexes, tasks):
+                self._merge_partial_indexes(partial)
+    
+    def _chunk_ranges(self, n_chunks: int) -> List[Tuple[int, int]]:
+        """
+        Split the input file into byte ranges ending on line boundaries.
+        
+        Args:
+            n_chunks: Approximate number of ranges
+            
+        Returns:
+            List of (start, end) byte offsets
+        """
+        size = os.path.getsize(self.input_file)
+        step = max(1, size // n_chunks)
+        ranges = []
+        with open(self.input_file, 'rb') as f:
+            start = 0
+            while start < size:
+                # Extend the range to the end of the line it stops in
+                f.seek(min(start + step, size))
+                f.readline()
+                end = f.tell()
+                ranges.append((start, end))
+                start = end
+        return ranges
+    
+    def _process_range(self, start: int, end: int):
+        """
+        Process the JSONL lines between two byte offsets of the input file.
+        
+        Args:
+            start: Offset of the first line
+            end: Offset just past the last line
+        """
+        with open(self.input_file, 'rb') as f, self._map_file(f) as mm:
+            self._process_lines(self._iter_lines(mm, start, end), 'byte')
+    
+    def _process_lines(self, lines: Iterable[Tuple[int, bytes]], unit: str):
+        """
+        Parse and process JSONL lines in batches.
+        
+        Args:
+            lines: (location, line) pairs
+            unit: What the location counts, used in error messages ('line' or 'byte')
+        """
+        batch_size = self.PARSE_BATCH_SIZE
+        locations = []
+        batch = []
+        for location, line in lines:
+            # Skip blank lines (json.loads tolerates surrounding whitespace)
+            if not line or line.isspace():
+                continue
+            locations.append(location)
+            batch.append(line)
+            if len(batch) >= batch_size:
+                self._process_batch(locations, batch, unit)
+                locations = []
+                batch = []
+        if batch:
+            self._process_batch(locations, batch, unit)
+    
+    def _process_batch(self, locations: List[int], batch: List[bytes], unit: str):
+        """
+        Parse a batch of JSONL lines and process the products.
+        
+        The whole batch is parsed under a single exception handler; only a
+        batch containing a line that fails to parse is re-parsed line by line.
+        
+        Args:
+            locations: Location of each line
+            batch: Lines to parse
+            unit: What the locations count ('line' or 'byte')
+        """
+        loads = json.loads
+        invalid = object()
+        try:
+            products = list(map(loads, batch))
+        except Exception:
+            # Invalid JSON, undecodable bytes or too-deep nesting: retry line by line
+            products = []
+            for location, line in zip(locations, batch):
+                try:
+                    products.append(loads(line))
+                except json.JSONDecodeError as e:
+                    print(f"JSON Error at {unit} {location}: {e}")
+                    products.append(invalid)
+                except Exception as e:
+                    print(f"Error processing {unit} {location}: {e}")
+                    products.append(invalid)
+        
+        process_product = self._process_product
+        for location, product in zip(locations, products):
+            if product is invalid:
+                continue
+            try:
+                process_product(product)
+            except Exception as e:
+                print(f"Error processing {unit} {location}: {e}")
+    
+    @staticmethod
+    def _map_file(f) -> ContextManager[mmap.mmap | bytes]:
+        """
+        Memory-map an open binary file for reading.
+        
+        Args:
+            f: File opened in binary mode
+            
+        Returns:
+            Context manager giving a read-only map of the file (empty bytes
+            for empty files, which cannot be mapped)
+        """
+        if os.fstat(f.fileno()).st_size == 0:
+            return contextlib.nullcontext(b'')
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    @staticmethod
+    def _iter_lines(mm: mmap.mmap | bytes, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+        """
+        Iterate over the lines of a mapped file between two byte offsets.
+        
+        Args:
+            mm: Mapped file
+            start: Offset of the first line
+            end: Offset just past the last line
+            
+        Returns:
+            Iterator of (offset, line) pairs, lines without their newline
+        """
+        find = mm.find
+        while start < end:
+            newline = find(b'\n', start, end)
+            if newline < 0:
+                newline = end
+            yield start, mm[start:newline]
+            start = newline + 1
+    
+    def _merge_partial_indexes(self, partial: Tuple[Dict, Dict, Dict, Dict, Dict, List[str], Dict[str, List[Path]]]):
+        """
+        Merge indexes built by a worker into this builder's indexes.
+        
+        Args:
+            partial: (title, description, brand, origin, reviews) indexes, the
+                worker's document URLs in ID order and its spilled run files
+        """
+        title_index, description_index, brand_index, origin_index, reviews_index, docs, runs = partial
+        
+        remap = None
+        if self.doc_ids:
+            # Translate the worker's document IDs to global ones
+            doc_id = self._doc_id
+            remap = [doc_id(url) for url in docs]
+            title_index, description_index = (
+                {token: {remap[doc]: positions for doc, positions in postings.items()}
+                 for token, postings in part.items()}
+                for part in (title_index, description_index)
+            )
+            brand_index, origin_index = (
+                {token: dict.fromkeys(remap[doc] for doc in docs_set)
+                 for token, docs_set in part.items()}
+                for part in (brand_index, origin_index)
+            )
+        
+        # Positional indexes
+        for index, part in ((self.title_index, title_index),
+                            (self.description_index, description_index)):
+            for token, part_postings in part.items():
+                self._buffered_postings += len(part_postings)
+                postings = index.get(token)
+                if postings is None:
+                    index[token] = part_postings
+                else:
+                    self._merge_postings(postings, part_postings)
+        
+        # Simple indexes
+        for index, part in ((self.brand_index, brand_index),
+                            (self.origin_index, origin_index)):
+            for token, urls in part.items():
+                index[token].update(urls)
+        
+        self.reviews_index.update(reviews_index)
+        
+        # Spilled runs follow this builder's runs, in chunk order
+        for name, paths in runs.items():
+            if remap is not None:
+                paths = [self._remap_run(name, path, remap) for path in paths]
+            self._runs[name].extend(paths)
+        
+        self._maybe_spill()
+    
+    def _remap_run(self, name: str, path: Path, remap: List[int]) -> Path:
+        """
+        Rewrite a worker's run file with global document IDs.
+        
+        Args:
+            name: Index name ('title' or 'description')
+            path: Run file written by the worker
+            remap: Global document ID of each worker document ID
+            
+        Returns:
+            Path of the rewritten run file
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = (
+                (token, {remap[doc]: positions for doc, positions in pairs})
+                for token, pairs in map(json.loads, f)
+            )
+            new_path = self._write_run(name, entries)
+        path.unlink()
+        return new_path
+    
+    def _doc_id(self, url: str) -> int:
+        """
+        Get the document ID of a URL, assigning the next one on first sight.
+        
+        Args:
+            url: Product URL
+            
+        Returns:
+            Document ID
+        """
+        doc_ids = self._doc_ids
+        return doc_ids.setdefault(url, len(doc_ids))
+    
+    @staticmethod
+    def _merge_postings(postings: Dict[str, List[int]], part: Dict[str, List[int]]):
+        """
+        Append the postings of a later part of the input to existing postings.
+        
+        Args:
+            postings: Postings of a token, updated in place
+            part: Postings of the same token from later documents
+        """
+        for doc, positions in part.items():
+            existing = postings.get(doc)
+            if existing is None:
+                postings[doc] = positions
+            else:
+                existing.extend(positions)
+    
+    def _maybe_spill(self):
+        """
+        Spill the positional indexes to disk if the spill threshold is reached.
+        """
+        if self.spill_threshold is not None and self._buffered_postings >= self.spill_threshold:
+            self._spill()
+    
+    def _spill(self):
+        """
+        Write the in-memory positional indexes to sorted run files and clear them.
+        """
+        for name, index in (('title', self.title_index),
+                            ('description', self.description_index)):
+            if not index:
+                continue
+            entries = ((token, index[token]) for token in sorted(index))
+            self._runs[name].append(self._write_run(name, entries))
+            index.clear()
+        self._buffered_postings = 0
+    
+    def _write_run(self, name: str, entries: Iterable[Tuple[str, Dict]]) -> Path:
+        """
+        Write (token, postings) entries, sorted by token, to a new run file.
+        
+        Args:
+            name: Index name ('title' or 'description')
+            entries: Entries sorted by token
+            
+        Returns:
+            Path of the run file
+        """
+        path = self._spill_directory() / f'{self._run_prefix}{name}_{self._run_count}.jsonl'
+        self._run_count += 1
+        encode = _JSON_ENCODER.encode
+        with open(path, 'w', encoding='utf-8') as f:
+            for token, postings in entries:
+                # Postings as pairs so integer document IDs survive JSON
+                f.write(encode([token, list(postings.items())]))
+                f.write('\n')
+        return path
+    
+    def _spill_directory(self) -> Path:
+        """
+        Get the directory holding run files, creating a temporary one if needed.
+        
+        Returns:
+            Run directory path
+        """
+        if self._spill_path is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix='index_runs_')
+            self._spill_path = Path(self._spill_dir.name)
+        return self._spill_path
+    
+    def _index_entries(self, name: str, index: Dict) -> Iterable[Tuple[str, Any]]:
+        """
+        Get the entries of a positional index, merging spilled runs if any.
+        
+        Args:
+            name: Index name ('title' or 'description')
+            index: In-memory part of the index
+            
+        Returns:
+            Iterable of (token, postings) pairs
+        """
+        if not self._runs[name]:
+            return index.items()
+        # Flush what is still buffered so every posting lives in a run
+        self._spill()
+        
+        # Merge in passes so that at most MERGE_FAN_IN runs are open at once;
+        # groups are consecutive, so postings keep input order
+        runs = self._runs[name]
+        fan_in = self.MERGE_FAN_IN
+        while len(runs) > fan_in:
+            merged = []
+            for i in range(0, len(runs), fan_in):
+                group = runs[i:i + fan_in]
+                merged.append(self._write_run(name, self._merge_runs(group)))
+                for path in group:
+                    path.unlink()
+            runs[:] = merged
+        return self._merge_runs(runs)
+    
+    @classmethod
+    def _merge_runs(cls, paths: List[Path]) -> Iterator[Tuple[str, Dict[str, List[int]]]]:
+        """
+        Stream the k-way merge of sorted run files, one token at a time.
+        
+        Args:
+            paths: Run files, in the order they were written
+            
+        Returns:
+            Iterator of (token, postings) pairs sorted by token
+        """
+        files = [open(path, 'r', encoding='utf-8') for path in paths]
+        try:
+            # heapq.merge is stable, so postings keep input order across runs
+            entries = heapq.merge(*(map(json.loads, f) for f in files), key=lambda e: e[0])
+            current, postings = None, None
+            for token, pairs in entries:
+                part = dict(pairs)
+                if token == current:
+                    cls._merge_postings(postings, part)
+                    continue
+                if current is not None:
+                    yield current, postings
+                current, postings = token, part
+            if current is not None:
+                yield current, postings
+        finally:
+            for f in files:
+                f.close()
     
     def _process_product(self, product: Dict[str, Any]):
         """
@@ -110,16 +572,23 @@ class IndexBuilder:
         url = product.get('url', '')
         if not url:
             return
+        # Shared by every posting list of this product
+        url = sys.intern(url)
+        # Key used in posting lists
+        doc = self._doc_id(url) if self.doc_ids else url
+        
+        index_text = self._index_text
+        tokenize_short = self._tokenize_short
         
         # Process title
         title = product.get('title', '')
         if title:
-            self._index_text(title, url, self.title_index)
+            index_text(title, doc, self.title_index)
         
         # Process description
         description = product.get('description', '')
         if description:
-            self._index_text(description, url, self.description_index)
+            index_text(description, doc, self.description_index)
         
         # Process features (brand and origin only)
         features = product.get('product_features', {})
@@ -128,26 +597,33 @@ class IndexBuilder:
         if 'brand' in features:
             brand = features['brand']
             if isinstance(brand, str) and brand:
-                tokens = self.tokenize(brand)
-                for token in tokens:
-                    self.brand_index[token].add(url)
+                brand_index = self.brand_index
+                for token in tokenize_short(brand):
+                    brand_index[token][doc] = None
         
         # Origin
         if 'made in' in features:
             origin = features['made in']
             if isinstance(origin, str) and origin:
-                tokens = self.tokenize(origin)
-                for token in tokens:
-                    self.origin_index[token].add(url)
+                origin_index = self.origin_index
+                for token in tokenize_short(origin):
+                    origin_index[token][doc] = None
         
         # Reviews
         reviews = product.get('product_reviews', [])
         if reviews:
-            ratings = [review.get('rating', 0) for review in reviews]
+            # Count, sum and last rating in a single pass
+            total = 0
+            count = 0
+            last_rating = 0
+            for review in reviews:
+                last_rating = review.get('rating', 0)
+                total += last_rating
+                count += 1
             self.reviews_index[url] = {
-                'total_reviews': len(reviews),
-                'mean_mark': round(sum(ratings) / len(ratings), 2) if ratings else 0,
-                'last_rating': ratings[-1] if ratings else 0
+                'total_reviews': count,
+                'mean_mark': round(total / count, 2) if count else 0,
+                'last_rating': last_rating
             }
         else:
             self.reviews_index[url] = {
@@ -156,76 +632,112 @@ class IndexBuilder:
                 'last_rating': 0
             }
     
-    def _index_text(self, text: str, url: str, index: Dict):
+    def _index_text(self, text: str, doc: str | int, index: Dict):
         """
         Add text to an inverted index with positions.
         
         Args:
             text: Text to index
-            url: Document URL
+            doc: Document URL (or document ID when doc_ids is set)
             index: Inverted index to update
         """
         tokens = self.tokenize(text)
+        
+        # Group positions by token for this document first
+        local_positions = {}
         for position, token in enumerate(tokens):
-            if token:
-                index[token][url].append(position)
+            positions = local_positions.get(token)
+            if positions is None:
+                local_positions[token] = [position]
+            else:
+                positions.append(position)
+        
+        # Merge once per distinct token into the global index
+        for token, positions in local_positions.items():
+            postings = index.get(token)
+            if postings is None:
+                index[token] = {doc: positions}
+            elif doc in postings:
+                # Same URL seen again in the input: keep previous positions
+                postings[doc].extend(positions)
+            else:
+                postings[doc] = positions
+        
+        self._buffered_postings += len(local_positions)
+        self._maybe_spill()
     
     def save_indexes(self):
         """
-        Save all indexes to JSON files.
+        Save all indexes to files in the configured format.
         """
+        ext = self.INDEX_FORMATS[self.index_format]
         try:
-            title_index_dict = {
-                token: {url: positions for url, positions in urls.items()}
-                for token, urls in self.title_index.items()
-            }
-            
-            description_index_dict = {
-                token: {url: positions for url, positions in urls.items()}
-                for token, urls in self.description_index.items()
-            }
-            
-            brand_index_dict = {
-                token: list(urls) for token, urls in self.brand_index.items()
-            }
-            
-            origin_index_dict = {
-                token: list(urls) for token, urls in self.origin_index.items()
-            }
-            
             # Save title index
-            with open(self.output_dir / 'title_index.json', 'w', encoding='utf-8') as f:
-                json.dump(title_index_dict, f, ensure_ascii=False, indent=2)
+            title_entries = self._index_entries('title', self.title_index)
+            self._dump_index(title_entries, self.output_dir / f'title_index{ext}')
             print(f"✓ Title index saved")
             
             # Save description index
-            with open(self.output_dir / 'description_index.json', 'w', encoding='utf-8') as f:
-                json.dump(description_index_dict, f, ensure_ascii=False, indent=2)
+            description_entries = self._index_entries('description', self.description_index)
+            self._dump_index(description_entries, self.output_dir / f'description_index{ext}')
             print(f"✓ Description index saved")
             
             # Save brand index
-            with open(self.output_dir / 'brand_index.json', 'w', encoding='utf-8') as f:
-                json.dump(brand_index_dict, f, ensure_ascii=False, indent=2)
+            brand_entries = (
+                (token, list(urls)) for token, urls in self.brand_index.items()
+            )
+            self._dump_index(brand_entries, self.output_dir / f'brand_index{ext}')
             print(f"✓ Brand index saved")
             
             # Save origin index
-            with open(self.output_dir / 'origin_index.json', 'w', encoding='utf-8') as f:
-                json.dump(origin_index_dict, f, ensure_ascii=False, indent=2)
+            origin_entries = (
+                (token, list(urls)) for token, urls in self.origin_index.items()
+            )
+            self._dump_index(origin_entries, self.output_dir / f'origin_index{ext}')
             print(f"✓ Origin index saved")
             
             # Save reviews index
-            with open(self.output_dir / 'reviews_index.json', 'w', encoding='utf-8') as f:
-                json.dump(self.reviews_index, f, ensure_ascii=False, indent=2)
+            self._dump_index(self.reviews_index.items(), self.output_dir / f'reviews_index{ext}')
             print(f"✓ Reviews index saved")
             
+            # Save document table
+            if self.doc_ids:
+                doc_entries = ((doc, url) for url, doc in self._doc_ids.items())
+                self._dump_index(doc_entries, self.output_dir / f'docs{ext}')
+                print(f"✓ Document table saved")
+            
         except Exception as e:
             print(f"Error saving indexes: {e}")
             raise
     
+    def _dump_index(self, entries: Iterable[Tuple[str, Any]], path: Path):
+        """
+        Write an index to a file in the configured format.
+        
+        JSON output is compact and written one entry at a time.
+        
+        Args:
+            entries: (key, value) pairs of the index to save (JSON keys are stringified)
+            path: Output file path
+        """
+        if self.index_format == 'pickle':
+            with open(path, 'wb') as f:
+                pickle.dump(dict(entries), f, protocol=5)
+            return
+        
+        encode = _JSON_ENCODER.encode
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{')
+            separator = ''
+            for key, value in entries:
+                f.write(f"{separator}{encode(str(key))}:{encode(value)}")
+                separator = ','
+            f.write('}')
+    
     @staticmethod
     def load_index(filename: str) -> Dict:
         """
-        Load an index from a JSON file.
+        Load an index from a JSON or pickle file (chosen by extension).
         
         Args:
             filename: Path to file to load
@@ -234,6 +746,9 @@ class IndexBuilder:
             Dictionary containing the index
         """
         try:
+            if Path(filename).suffix == IndexBuilder.INDEX_FORMATS['pickle']:
+                with open(filename, 'rb') as f:
+                    return pickle.load(f)
             with open(filename, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except FileNotFoundError:
@@ -242,6 +757,9 @@ class IndexBuilder:
         except json.JSONDecodeError:
             print(f"Error: Invalid JSON format in '{filename}'")
             raise
+        except pickle.UnpicklingError:
+            print(f"Error: Invalid pickle format in '{filename}'")
+            raise
     
     def search_title(self, query: str, index_dict: Dict) -> List[str]:
         """
@@ -252,7 +770,8 @@ class IndexBuilder:
             index_dict: Dictionary of title index
             
         Returns:
-            List of URLs containing the term
+            List of URLs containing the term (document IDs for an index built
+            with doc_ids; resolve them with the 'docs' index)
         """
         tokens = self.tokenize(query)
         if not tokens:
@@ -261,8 +780,8 @@ class IndexBuilder:
         results = None
         for token in tokens:
             if token in index_dict:
-                urls = set(index_dict[token].keys())
-                results = urls if results is None else results & urls
+                docs = set(index_dict[token].keys())
+                results = docs if results is None else results & docs
             else:
                 return []  # No results if a token finds nothing
         
@@ -270,6 +789,33 @@ class IndexBuilder:
     
 
 
+def _build_partial_indexes(task: Tuple[str, str, bool, int | None, str | None, int, int, int]
+                           ) -> Tuple[Dict, Dict, Dict, Dict, Dict, List[str], Dict[str, List[Path]]]:
+    """
+    Worker entry point: build indexes for one byte range of the input file.
+    
+    Args:
+        task: (input_file, output_dir, doc_ids, spill_threshold, spill_dir, chunk, start, end)
+        
+    Returns:
+        Tuple (title, description, brand, origin, reviews) of partial indexes,
+        followed by the document URLs in local ID order and the run files
+        spilled to spill_dir (the positional indexes are then empty)
+    """
+    input_file, output_dir, doc_ids, spill_threshold, spill_dir, chunk, start, end = task
+    builder = IndexBuilder(input_file, output_dir, spill_threshold=spill_threshold, doc_ids=doc_ids)
+    if spill_dir is not None:
+        # Runs live in the parent's directory, which outlives this worker
+        builder._spill_path = Path(spill_dir)
+        builder._run_prefix = f'chunk{chunk}_'
+    builder._process_range(start, end)
+    if spill_threshold is not None:
+        builder._spill()
+    return (builder.title_index, builder.description_index,
+            builder.brand_index, builder.origin_index, builder.reviews_index,
+            list(builder._doc_ids), builder._runs)
+
+
 def main():
     """Main function."""
     print("Starting index building...")